@@ -1,60 +1,231 @@
 import csv
-from datetime import date, timedelta
+import functools
+import json
+import mmap
+from collections import defaultdict, deque
+from datetime import date
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, DefaultDict, Deque, List, NamedTuple, Optional, Set, Tuple
 
 PROJECT_ROOT = Path(__file__).parent
 DATA_DIR = PROJECT_ROOT / "data"
 CSV_PATH = DATA_DIR / "mood_log.csv"
 
+# CSV 只追加写入：记录已解析到的字节偏移，文件增长时只解析新增尾部
+_DIARY_TAIL = 100  # 缓存的日记条数上限（与主菜单可选的最大条数一致）
+_FENCE_SIZE = 64  # 偏移前保留的字节数，用于识别文件是否被改写
+_MSG_KEEP_DAYS = 90  # 默认只为最近这么多天的记录解码 message 列
+
+
+class _LogState:
+    def __init__(self, path: str = "", ino: int = 0, msg_floor: int = 0) -> None:
+        self.path = path
+        self.ino = ino
+        self.msg_floor = msg_floor  # 日期序数不小于它的记录才保留 message
+        self.sig: Optional[Tuple[str, int, int]] = None
+        self.offset = 0
+        self.header = b""
+        self.fence = b""
+        self.daily_sums: DefaultDict[int, int] = defaultdict(int)
+        self.daily_counts: DefaultDict[int, int] = defaultdict(int)  # 分数有效的行数，用于求均值
+        self.daily_rows: DefaultDict[int, int] = defaultdict(int)  # 当天的全部行数，含分数缺失的行
+        self.diary_rows: Deque[List[str]] = deque(maxlen=_DIARY_TAIL)
+        self.messages: DefaultDict[int, List[str]] = defaultdict(list)
+
+
+_STATE = _LogState()
+
+
+def _can_resume(state: _LogState, f: BinaryIO, path: str, ino: int, size: int) -> bool:
+    """判断文件自上次解析后是否仅发生了追加。"""
+    if state.sig is None or state.path != path or state.ino != ino:
+        return False
+    if size < state.offset or not state.fence.endswith(b"\n"):
+        return False
+    f.seek(0)
+    if f.readline() != state.header:
+        return False
+    f.seek(state.offset - len(state.fence))
+    return f.read(len(state.fence)) == state.fence
+
+
+def _sync_state(csv_path: Optional[Path] = None, msg_floor: Optional[int] = None) -> Optional[_LogState]:
+    """将 _STATE 与磁盘上的 CSV 对齐；文件不存在时返回 None。
+
+    msg_floor 早于当前保留的 message 范围时会整体重新扫描一次。
+    """
+    global _STATE
+    csv_path = csv_path or CSV_PATH
+    try:
+        st = csv_path.stat()
+    except OSError:
+        return None
+    path = str(csv_path)
+    sig = (path, st.st_mtime_ns, st.st_size)
+    wider = msg_floor is not None and msg_floor < _STATE.msg_floor
+    if _STATE.sig == sig and not wider:
+        return _STATE
+
+    default_floor = date.today().toordinal() - _MSG_KEEP_DAYS + 1
+    with csv_path.open("rb") as f:
+        if wider or not _can_resume(_STATE, f, path, st.st_ino, st.st_size):
+            floor = default_floor if msg_floor is None else min(default_floor, msg_floor)
+            _STATE = _LogState(path, st.st_ino, floor)
+            f.seek(0)
+            _STATE.header = f.readline()
+            _STATE.offset = len(_STATE.header)
+            _STATE.fence = _STATE.header[-_FENCE_SIZE:]
+        state = _STATE
+        if st.st_size > state.offset:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _scan_tail(state, mm, state.offset)
+                state.offset = len(mm)
+                state.fence = mm[max(0, state.offset - _FENCE_SIZE):state.offset]
+    state.sig = sig
+    return state
+
+
+def _scan_tail(state: _LogState, mm: mmap.mmap, pos: int) -> None:
+    """逐行扫描 mm[pos:]，只切分出日期与分数两个字段。
+
+    date/score 由程序写入，不含引号与逗号，可直接按字节切分；
+    message 只在 msg_floor 之后的行才解码，带引号时与 note 非空的行一样交给 csv 模块解析。
+    """
+    sums = state.daily_sums
+    counts = state.daily_counts
+    rows = state.daily_rows
+    diary_rows = state.diary_rows
+    messages = state.messages
+    msg_floor = state.msg_floor
+    # 行按日期顺序追加，相邻行日期多半相同，记住上一行的换算结果
+    last_day = b""
+    last_ordinal: Optional[int] = None
+    find = mm.find
+    end = len(mm)
+    while pos < end:
+        nl = find(b"\n", pos)
+        if nl < 0:
+            nl = end
+        line = mm[pos:nl]
+        pos = nl + 1
+        parts = line.split(b",", 3)
+        if len(parts) < 2:
+            # 只有日期一列的残缺行也计入当天行数
+            ordinal = _day_ordinal(line.rstrip(b"\r"))
+            if ordinal is not None:
+                rows[ordinal] += 1
+            continue
+        day = parts[0]  # 日期由 append_record 写入，固定为 YYYY-MM-DD，无需 strip
+        if day != last_day:
+            last_day = day
+            last_ordinal = _day_ordinal(day)
+        if last_ordinal is not None:
+            rows[last_ordinal] += 1
+            try:
+                score = int(parts[1])
+            except ValueError:
+                score = None
+            if score is not None:
+                sums[last_ordinal] += score
+                counts[last_ordinal] += 1
+            if last_ordinal >= msg_floor and len(parts) >= 3:
+                if parts[2].startswith(b'"'):
+                    r = next(csv.reader([line.decode("utf-8")]))
+                    messages[last_ordinal].append(r[2])
+                else:
+                    messages[last_ordinal].append(parts[2].rstrip(b"\r").decode("utf-8"))
+        if len(parts) == 4 and parts[3].strip():
+            r = next(csv.reader([line.decode("utf-8")]), [])
+            if len(r) >= 4 and str(r[3]).strip():
+                diary_rows.append(r)
+
+
+def _day_ordinal(day: bytes) -> Optional[int]:
+    """把 b"YYYY-MM-DD" 换算为 date 序数；格式不符时返回 None。"""
+    if len(day) != 10 or day[4:5] != b"-" or day[7:8] != b"-":
+        return None
+    try:
+        return date(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal()
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=512)
+def _day_label(ordinal: int) -> str:
+    """图表/表格使用的 MM-DD 标签。"""
+    return date.fromordinal(ordinal).isoformat()[-5:]
 
-def _read_all_records() -> List[Tuple[str, int]]:
-    if not CSV_PATH.exists():
-        return []
-    out: List[Tuple[str, int]] = []
-    with CSV_PATH.open("r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        _ = next(reader, None)
-        for r in reader:
-            if len(r) >= 2:
-                day = str(r[0]).strip()
-                try:
-                    score = int(r[1])
-                except Exception:
-                    continue
-                out.append((day, score))
-    return out
 
+def _aggregate_daily_average(state: _LogState, days: List[int]) -> List[Optional[float]]:
+    """按日期对齐的日均值视图，仅计算请求的日期。"""
+    sums = state.daily_sums
+    counts = state.daily_counts
+    return [sums[d] / counts[d] if d in counts else None for d in days]
 
-def _aggregate_daily_average(records: List[Tuple[str, int]]) -> Dict[str, float]:
-    sums: Dict[str, int] = {}
-    counts: Dict[str, int] = {}
-    for d, s in records:
-        sums[d] = sums.get(d, 0) + s
-        counts[d] = counts.get(d, 0) + 1
-    return {d: sums[d] / counts[d] for d in sums}
 
+@functools.lru_cache(maxsize=32)
+def _last_n_iso_dates(today_ordinal: int, n: int) -> Tuple[str, ...]:
+    """以 today_ordinal 结尾的 n 个 ISO 日期；同一天内重复调用直接命中缓存。"""
+    return tuple(date.fromordinal(o).isoformat() for o in range(today_ordinal - n + 1, today_ordinal + 1))
 
-def _last_n_dates(n: int) -> List[str]:
-    today = date.today()
-    days = [today - timedelta(days=i) for i in range(n - 1, -1, -1)]
-    return [d.isoformat() for d in days]
+
+def _last_n_dates(n: int) -> List[int]:
+    """最近 n 天（含今天）的日期序数，按时间升序。"""
+    today = date.today().toordinal()
+    return list(range(today - n + 1, today + 1))
 
 
 def _to_sparkline(values: List[Optional[float]]) -> str:
     blocks = "▁▂▃▄▅▆▇█"
+    top = len(blocks) - 1
     out_chars: List[str] = []
     for v in values:
         if v is None:
             out_chars.append("·")
         else:
-            v = max(1.0, min(10.0, float(v)))
-            idx = int(round((v - 1.0) / 9.0 * (len(blocks) - 1)))
-            idx = max(0, min(len(blocks) - 1, idx))
-            out_chars.append(blocks[idx])
+            # 直接对索引做 clamp，等价于先把 v 限制在 [1,10]，省去 max/min 调用
+            idx = round((v - 1.0) / 9.0 * top)
+            out_chars.append(blocks[0 if idx < 0 else top if idx > top else idx])
     return "".join(out_chars)
 
 
+class ScanResult(NamedTuple):
+    """scan_all 一次扫描得到的各项派生结果。"""
+
+    recent_messages: Set[str]  # 最近 msg_window 天内用过的寄语
+    diary_tail: List[List[str]]  # 最近 diary_k 条 note 非空的原始行
+    days: List[str]  # 最近 stats_n 天的 ISO 日期
+    values: List[Optional[float]]  # 与 days 对齐的日均值，无记录为 None
+    today_count: int  # 今天已记录的次数
+
+
+def scan_all(
+    msg_window: int = 30, diary_k: int = 10, stats_n: int = 30, csv_path: Optional[Path] = None
+) -> ScanResult:
+    """一次（增量）扫描 CSV，同时给出寄语去重、日记、统计所需的数据。"""
+    today = date.today().toordinal()
+    cutoff = today - msg_window + 1
+    state = _sync_state(csv_path, msg_floor=cutoff)
+    if state is None:
+        return ScanResult(set(), [], [], [], 0)
+
+    recent: Set[str] = set()
+    for o in range(cutoff, today + 1):
+        if o in state.messages:
+            recent.update(state.messages[o])
+    # 最多返回缓存的 _DIARY_TAIL 条；复制各行，调用方修改结果不会影响缓存
+    diary_tail = [list(r) for r in state.diary_rows][-diary_k:] if diary_k > 0 else []
+    days = list(range(today - stats_n + 1, today + 1))
+    values = _aggregate_daily_average(state, days)
+    return ScanResult(
+        recent_messages=recent,
+        diary_tail=diary_tail,
+        days=list(_last_n_iso_dates(today, stats_n)),
+        values=values,
+        today_count=state.daily_rows.get(today, 0),
+    )
+
+
 def render_trend(last_days: int = 30) -> None:
     """读取 CSV 并打印最近 N 天的心情趋势与统计。"""
     days, aligned_values = _read_aligned_series(last_days)
@@ -63,26 +234,41 @@ def render_trend(last_days: int = 30) -> None:
         return
 
     spark = _to_sparkline(aligned_values)
-    available = [v for v in aligned_values if v is not None]
+    n, total, mn, mx = _summarize(aligned_values)
     print(f"\n=== 最近{last_days}天心情趋势 ===")
     print(f"曲线: {spark}")
-    print("日期: " + " ".join(d[-5:] for d in days))
-    if available:
-        avg = sum(available) / len(available)
-        mn = min(available)
-        mx = max(available)
-        print(f"可用天数: {len(available)}/{last_days} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
+    print("日期: " + " ".join(_day_label(d) for d in days))
+    if n:
+        avg = total / n
+        print(f"可用天数: {n}/{last_days} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
     else:
         print("选定范围内没有可用记录。")
 
 
-def _read_aligned_series(last_days: int) -> Tuple[List[str], List[Optional[float]]]:
-    records = _read_all_records()
-    if not records:
+def _summarize(values: List[Optional[float]]) -> Tuple[int, float, float, float]:
+    """一次遍历同时求出可用个数、总和、最小值与最大值（跳过 None）。"""
+    n = 0
+    total = 0.0
+    mn = float("inf")
+    mx = float("-inf")
+    for v in values:
+        if v is None:
+            continue
+        n += 1
+        total += v
+        if v < mn:
+            mn = v
+        if v > mx:
+            mx = v
+    return n, total, mn, mx
+
+
+def _read_aligned_series(last_days: int) -> Tuple[List[int], List[Optional[float]]]:
+    state = _sync_state()
+    if state is None or not state.daily_counts:
         return [], []
-    daily_avg = _aggregate_daily_average(records)
     days = _last_n_dates(last_days)
-    aligned_values: List[Optional[float]] = [daily_avg.get(d) for d in days]
+    aligned_values = _aggregate_daily_average(state, days)
     return days, aligned_values
 
 
@@ -94,7 +280,7 @@ def render_ascii_bar(last_days: int = 30) -> None:
         return
     print(f"\n=== 最近{last_days}天心情柱状图 ===")
     for d, v in zip(days, values):
-        label = d[-5:]
+        label = _day_label(d)
         if v is None:
             bar = "(无)"
         else:
@@ -104,11 +290,48 @@ def render_ascii_bar(last_days: int = 30) -> None:
         print(f"{label} | {bar}")
 
 
+# 图表结构固定，直接套用模板生成 HTML，无需导入 plotly
+_PLOTLY_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<script src="https://cdn.plot.ly/plotly-2.35.2.min.js"></script>
+</head>
+<body>
+<div id="chart" style="height:100vh;"></div>
+<script>
+Plotly.newPlot("chart", %s, %s, {"responsive": true});
+</script>
+</body>
+</html>
+"""
+
+# export_png 复用的 Figure/Axes，重复导出时只清空重画
+_FIG = None
+_AX = None
+# matplotlib 的 Figure 类；None 表示尚未检测，False 表示未安装
+_FIGURE_CLS = None
+
+
+def _get_figure_class():
+    """返回 matplotlib.figure.Figure，只在首次调用时尝试导入。"""
+    global _FIGURE_CLS
+    if _FIGURE_CLS is None:
+        try:
+            # 只导出文件，直接用 Figure（Agg 画布），不经过 pyplot 的后端探测
+            from matplotlib.figure import Figure  # type: ignore
+
+            _FIGURE_CLS = Figure
+        except Exception:
+            _FIGURE_CLS = False
+    return _FIGURE_CLS or None
+
+
 def export_png(last_days: int = 30, out_path: Optional[str] = None) -> Optional[str]:
     """导出最近 N 天趋势为 PNG。需要 matplotlib。返回输出路径或 None。"""
-    try:
-        import matplotlib.pyplot as plt  # type: ignore
-    except Exception:
+    global _FIG, _AX
+    Figure = _get_figure_class()
+    if Figure is None:
         print("未安装 matplotlib，无法导出 PNG。请先安装：pip install matplotlib")
         return None
 
@@ -120,7 +343,14 @@ def export_png(last_days: int = 30, out_path: Optional[str] = None) -> Optional[
     y = [float(v) if v is not None else None for v in values]
     x = list(range(len(days)))
 
-    fig, ax = plt.subplots(figsize=(max(6, last_days * 0.2), 3))
+    figsize = (max(6, last_days * 0.2), 3)
+    if _FIG is None:
+        _FIG = Figure(figsize=figsize)
+        _AX = _FIG.add_subplot()
+    else:
+        _AX.clear()
+        _FIG.set_size_inches(*figsize)
+    fig, ax = _FIG, _AX
     ax.plot(x, y, marker="o")
     ax.set_ylim(1, 10)
     ax.set_ylabel("score")
@@ -128,7 +358,7 @@ def export_png(last_days: int = 30, out_path: Optional[str] = None) -> Optional[
     # 仅显示稀疏刻度，避免过密
     step = max(1, last_days // 10)
     ax.set_xticks(x[::step])
-    ax.set_xticklabels([d[-5:] for d in days][::step], rotation=45, ha="right")
+    ax.set_xticklabels([_day_label(d) for d in days][::step], rotation=45, ha="right")
     fig.tight_layout()
 
     if out_path is None:
@@ -139,34 +369,28 @@ def export_png(last_days: int = 30, out_path: Optional[str] = None) -> Optional[
         out_file.parent.mkdir(parents=True, exist_ok=True)
 
     fig.savefig(out_file, dpi=150)
-    plt.close(fig)
     print(f"PNG 已导出: {out_file}")
     return str(out_file)
 
 
 def export_html(last_days: int = 30, out_path: Optional[str] = None) -> Optional[str]:
-    """导出最近 N 天趋势为交互式 HTML。需要 plotly。返回输出路径或 None。"""
-    try:
-        import plotly.graph_objects as go  # type: ignore
-    except Exception:
-        print("未安装 plotly，无法导出 HTML。请先安装：pip install plotly")
-        return None
-
+    """导出最近 N 天趋势为交互式 HTML（打开时从 CDN 加载 plotly.js）。返回输出路径或 None。"""
     days, values = _read_aligned_series(last_days)
     if not days:
         print("暂无历史数据用于导出。")
         return None
 
     y = [float(v) if v is not None else None for v in values]
-    x = [d[-5:] for d in days]
-
-    fig = go.Figure(data=[go.Scatter(x=x, y=y, mode="lines+markers")])
-    fig.update_layout(
-        title=f"Mood Trend (last {last_days} days)",
-        yaxis=dict(range=[1, 10], title="score"),
-        xaxis=dict(title="date"),
-        margin=dict(l=40, r=20, t=40, b=40),
-    )
+    x = [_day_label(d) for d in days]
+
+    data = [{"x": x, "y": y, "mode": "lines+markers", "type": "scatter"}]
+    layout = {
+        "title": {"text": f"Mood Trend (last {last_days} days)"},
+        "yaxis": {"range": [1, 10], "title": {"text": "score"}},
+        "xaxis": {"title": {"text": "date"}},
+        "margin": {"l": 40, "r": 20, "t": 40, "b": 40},
+    }
+    html = _PLOTLY_HTML_TEMPLATE % (json.dumps(data), json.dumps(layout))
 
     if out_path is None:
         DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -175,24 +399,15 @@ def export_html(last_days: int = 30, out_path: Optional[str] = None) -> Optional
         out_file = Path(out_path)
         out_file.parent.mkdir(parents=True, exist_ok=True)
 
-    fig.write_html(out_file, include_plotlyjs="cdn")
+    out_file.write_text(html, encoding="utf-8")
     print(f"HTML 已导出: {out_file}")
     return str(out_file)
 
 
 def render_diary(last_k: int = 10) -> None:
     """显示最近 K 条包含日记(note 非空)的记录。"""
-    if not CSV_PATH.exists():
-        print("暂无日记记录。")
-        return
-    rows: List[List[str]] = []
-    with CSV_PATH.open("r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        _ = next(reader, None)
-        for r in reader:
-            rows.append(r)
-    # 过滤 note 非空
-    diary_rows = [r for r in rows if len(r) >= 4 and str(r[3]).strip()]
+    state = _sync_state()
+    diary_rows = list(state.diary_rows) if state is not None else []
     if not diary_rows:
         print("暂无日记记录。")
         return
@@ -202,5 +417,5 @@ def render_diary(last_k: int = 10) -> None:
         score = r[1] if len(r) > 1 else ""
         note = r[3]
         print(f"{day} (score {score})\n- {note}\n")
-
-
+    if last_k > _DIARY_TAIL and len(diary_rows) == _DIARY_TAIL:
+        print(f"（仅缓存最近{_DIARY_TAIL}条日记，更早的记录未显示）")
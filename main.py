@@ -1,10 +1,13 @@
 import csv
+import functools
 import json
+import mmap
 import random
 import sys
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Set
+from typing import DefaultDict, Dict, List, Tuple, Optional, Set
 
 IS_FROZEN = getattr(sys, "frozen", False)
 
@@ -18,6 +21,8 @@ PROJECT_ROOT = get_project_root()
 EXE_DIR = Path(sys.executable).parent if IS_FROZEN else PROJECT_ROOT
 DATA_DIR = (EXE_DIR if IS_FROZEN else PROJECT_ROOT) / "data"
 CSV_PATH = DATA_DIR / "mood_log.csv"
+# 表头已是四列(含 note)的标记文件，存在时启动跳过 upgrade_csv_schema
+SCHEMA_SENTINEL = DATA_DIR / ".schema_v2"
 # 同时兼容 messages.json 与 message.json 两种命名
 CANDIDATE_MESSAGE_PATHS = [
     PROJECT_ROOT / "messages.json",
@@ -33,8 +38,10 @@ def ensure_storage():
             writer = csv.writer(f)
             # 升级后的表头：增加 note 列用于小型日记
             writer.writerow(["date", "score", "message", "note"])  # 表头
-    else:
-        upgrade_csv_schema()
+        SCHEMA_SENTINEL.touch()
+    elif not SCHEMA_SENTINEL.exists():
+        if upgrade_csv_schema():
+            SCHEMA_SENTINEL.touch()
 
 def load_messages() -> Dict[str, List[str]]:
     # 内置默认文案，防止缺失文件导致崩溃
@@ -69,18 +76,21 @@ def load_messages() -> Dict[str, List[str]]:
         print("读取 messages.json 失败，已使用默认文案。")
         return defaults
 
-def upgrade_csv_schema():
-    """将旧版三列表头(date, score, message)升级为四列，追加 note 列。"""
+def upgrade_csv_schema() -> bool:
+    """将旧版三列表头(date, score, message)升级为四列，追加 note 列。
+
+    返回 CSV 是否已是四列格式（无法读取时为 False）。
+    """
     try:
         with CSV_PATH.open("r", encoding="utf-8", newline="") as f:
             reader = csv.reader(f)
             header = next(reader, None)
             rows = list(reader)
     except FileNotFoundError:
-        return
+        return False
     except Exception:
         # 无法读取时跳过升级，避免破坏现有数据
-        return
+        return False
 
     # 空文件或仅有数据无表头的情况，一并标准化
     if header is None:
@@ -92,7 +102,7 @@ def upgrade_csv_schema():
                     writer.writerow([r[0], r[1], r[2], ""])  # 旧行补空 note
                 else:
                     writer.writerow(r)
-        return
+        return True
 
     if len(header) == 3:
         with CSV_PATH.open("w", encoding="utf-8", newline="") as f:
@@ -103,6 +113,7 @@ def upgrade_csv_schema():
                     writer.writerow([r[0], r[1], r[2], ""])  # 旧行补空 note
                 else:
                     writer.writerow(r)
+    return True
 
 def ask_for_score() -> int:
     while True:
@@ -143,18 +154,33 @@ def read_existing_for_date(target_date: str) -> List[List[str]]:
     if not CSV_PATH.exists():
         return []
     rows = []
-    with CSV_PATH.open("r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        _ = next(reader, None)
-        for r in reader:
-            if len(r) >= 1 and r[0] == target_date:
-                rows.append(r)
+    target = target_date.encode("utf-8")
+    prefix = target + b","
+    with CSV_PATH.open("rb") as f:
+        if f.seek(0, 2) == 0:
+            return rows  # 空文件无法 mmap
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            pos = mm.find(b"\n") + 1  # 跳过表头
+            while 0 < pos < end:
+                nl = mm.find(b"\n", pos)
+                if nl < 0:
+                    nl = end
+                line = mm[pos:nl]
+                pos = nl + 1
+                # 只有日期匹配的行才做完整的 CSV 解析
+                if line.startswith(prefix) or line.rstrip(b"\r") == target:
+                    rows.append(next(csv.reader([line.decode("utf-8")])))
     return rows
 
-def append_record(day: str, score: int, message: str, note: str):
+def append_records(rows: List[Tuple[str, int, str, str]]):
+    """批量追加 (date, score, message, note) 记录，只打开一次文件。"""
     with CSV_PATH.open("a", encoding="utf-8", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow([day, score, message, note])
+        writer.writerows(rows)
+
+def append_record(day: str, score: int, message: str, note: str):
+    append_records([(day, score, message, note)])
 
 # === 统计与可视化 ===
 
@@ -171,9 +197,8 @@ def read_recent_messages(last_days: int = 30) -> Set[str]:
             _ = next(reader, None)
             for r in reader:
                 if len(r) >= 3:
-                    day_str = str(r[0]).strip()
                     try:
-                        d = date.fromisoformat(day_str)
+                        d = date.fromisoformat(r[0])
                     except Exception:
                         continue
                     if cutoff <= d <= today:
@@ -191,7 +216,7 @@ def read_all_records() -> List[Tuple[str, int]]:
         _ = next(reader, None)
         for r in reader:
             if len(r) >= 2:
-                day = str(r[0]).strip()
+                day = r[0]
                 try:
                     score = int(r[1])
                 except Exception:
@@ -199,95 +224,128 @@ def read_all_records() -> List[Tuple[str, int]]:
                 out.append((day, score))
     return out
 
-def aggregate_daily_average(records: List[Tuple[str, int]]) -> Dict[str, float]:
-    # 多条同日记录 → 取均值
-    sums: Dict[str, int] = {}
-    counts: Dict[str, int] = {}
+def aggregate_daily_average(
+    records: List[Tuple[str, int]], wanted: Optional[Set[str]] = None
+) -> Dict[str, float]:
+    # 多条同日记录 → 取均值；给定 wanted 时只汇总其中的日期
+    sums: DefaultDict[str, int] = defaultdict(int)
+    counts: DefaultDict[str, int] = defaultdict(int)
     for d, s in records:
-        sums[d] = sums.get(d, 0) + s
-        counts[d] = counts.get(d, 0) + 1
+        if wanted is not None and d not in wanted:
+            continue
+        sums[d] += s
+        counts[d] += 1
     return {d: sums[d] / counts[d] for d in sums}
 
+@functools.lru_cache(maxsize=32)
+def last_n_dates_cached(today_ordinal: int, n: int) -> Tuple[str, ...]:
+    # 同一天内结果不变，按 (今天, n) 缓存
+    base = date.fromordinal(today_ordinal)
+    return tuple((base - timedelta(days=i)).isoformat() for i in range(n - 1, -1, -1))
+
 def last_n_dates(n: int) -> List[str]:
-    today = date.today()
-    days = [today - timedelta(days=i) for i in range(n - 1, -1, -1)]
-    return [d.isoformat() for d in days]
+    return list(last_n_dates_cached(date.today().toordinal(), n))
 
 def to_sparkline(values: List[Optional[float]]) -> str:
     # 将 1-10 映射到 ▁▂▃▄▅▆▇█，缺失为 ·
     blocks = "▁▂▃▄▅▆▇█"
+    top = len(blocks) - 1
     out_chars: List[str] = []
     for v in values:
         if v is None:
             out_chars.append("·")
         else:
-            # clamp 到 [1,10]
-            v = max(1.0, min(10.0, float(v)))
-            # 线性映射到 0..7
-            idx = int(round((v - 1.0) / 9.0 * (len(blocks) - 1)))
-            idx = max(0, min(len(blocks) - 1, idx))
-            out_chars.append(blocks[idx])
+            # 线性映射到 0..7；直接 clamp 索引，等价于先把 v 限制在 [1,10]
+            idx = round((v - 1.0) / 9.0 * top)
+            out_chars.append(blocks[0 if idx < 0 else top if idx > top else idx])
     return "".join(out_chars)
 
-def show_recent_stats(k: int = 7):
-    records = read_all_records()
-    if not records:
-        print("\n暂无历史数据用于统计。")
-        return
-    daily_avg = aggregate_daily_average(records)
-    days = last_n_dates(k)
-    aligned_values: List[Optional[float]] = [daily_avg.get(d) for d in days]
+# Rich 的 (Console, Table)；None 表示尚未检测，False 表示未安装
+_RICH = None
 
-    spark = to_sparkline(aligned_values)
-    available = [v for v in aligned_values if v is not None]
+def get_rich():
+    """返回 Rich 的 (Console, Table)，只在首次调用时尝试导入。"""
+    global _RICH
+    if _RICH is None:
+        try:
+            from rich.console import Console  # type: ignore
+            from rich.table import Table  # type: ignore
 
-    # 优先使用 Rich 表格展示；若缺失则回退到纯文本
-    try:
-        from rich.console import Console  # type: ignore
-        from rich.table import Table  # type: ignore
-
-        console = Console()
-        table = Table(title="最近7天统计")
-        table.add_column("日期", justify="center")
-        table.add_column("均值", justify="right")
-        table.add_column("迷你柱", justify="left")
-
-        for d, v in zip(days, aligned_values):
-            if v is None:
-                mean_text = "-"
-                bar = ""
+            _RICH = (Console, Table)
+        except Exception:
+            _RICH = False
+    return _RICH or None
+
+def show_recent_stats(k: int = 7, series: Optional[Tuple[List[str], List[Optional[float]]]] = None):
+    # series 为 (日期列表, 对齐的日均值)，已由调用方算好时直接使用，不再读取 CSV
+    if series is not None:
+        days, aligned_values = series
+    else:
+        records = read_all_records()
+        if not records:
+            print("\n暂无历史数据用于统计。")
+            return
+        days = last_n_dates(k)
+        daily_avg = aggregate_daily_average(records, wanted=set(days))
+        aligned_values = [daily_avg.get(d) for d in days]
+
+    # 优先使用 Rich 表格展示；若缺失或渲染失败则回退到纯文本
+    rich = get_rich()
+    if rich is not None:
+        try:
+            Console, Table = rich
+            available = [v for v in aligned_values if v is not None]
+            console = Console()
+            table = Table(title="最近7天统计")
+            table.add_column("日期", justify="center")
+            table.add_column("均值", justify="right")
+            table.add_column("迷你柱", justify="left")
+
+            for d, v in zip(days, aligned_values):
+                if v is None:
+                    mean_text = "-"
+                    bar = ""
+                else:
+                    mean_text = f"{v:.2f}"
+                    length = max(1, min(10, int(round(float(v)))))
+                    bar = "█" * length
+                table.add_row(d[-5:], mean_text, bar)
+
+            console.print(table)
+            if available:
+                avg = sum(available) / len(available)
+                mn = min(available)
+                mx = max(available)
+                console.print(f"可用天数: {len(available)}/{k} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
             else:
-                mean_text = f"{v:.2f}"
-                length = max(1, min(10, int(round(float(v)))))
-                bar = "█" * length
-            table.add_row(d[-5:], mean_text, bar)
-
-        console.print(table)
-        if available:
-            avg = sum(available) / len(available)
-            mn = min(available)
-            mx = max(available)
-            console.print(f"可用天数: {len(available)}/{k} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
-        else:
-            console.print("最近7天没有可用记录。")
-    except Exception:
-        print("\n—— 最近7天统计 ——")
-        print(f"曲线: {spark}")
-        print("日期: " + " ".join(d[-5:] for d in days))
-        if available:
-            avg = sum(available) / len(available)
-            mn = min(available)
-            mx = max(available)
-            print(f"可用天数: {len(available)}/{k} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
-        else:
-            print("最近7天没有可用记录。")
+                console.print("最近7天没有可用记录。")
+            return
+        except Exception:
+            pass
+    print_recent_stats_text(k, days, aligned_values)
+
+def print_recent_stats_text(k: int, days: List[str], aligned_values: List[Optional[float]]):
+    # 纯文本版最近统计（未安装 Rich 或表格渲染失败时使用）
+    spark = to_sparkline(aligned_values)
+    available = [v for v in aligned_values if v is not None]
+    print("\n—— 最近7天统计 ——")
+    print(f"曲线: {spark}")
+    print("日期: " + " ".join(d[-5:] for d in days))
+    if available:
+        avg = sum(available) / len(available)
+        mn = min(available)
+        mx = max(available)
+        print(f"可用天数: {len(available)}/{k} | 均值: {avg:.2f} | 最低: {mn:.2f} | 最高: {mx:.2f}")
+    else:
+        print("最近7天没有可用记录。")
 
 def main():
     # 延迟导入，避免编辑器静态分析路径导致的解析告警
     try:
-        from data_manager import render_trend  # type: ignore
+        from data_manager import render_trend, scan_all  # type: ignore
     except Exception:
         render_trend = None  # 运行时若找不到会按未安装处理
+        scan_all = None
 
     print("=== How are you doing from 1–10 ===")
     ensure_storage()
@@ -295,9 +353,15 @@ def main():
 
     while True:
         today_str = date.today().isoformat()
-        existing = read_existing_for_date(today_str)
-        if existing:
-            print(f"提示：今天({today_str})已记录 {len(existing)} 次。")
+        # 一次扫描同时拿到今日次数与最近寄语；data_manager 不可用时逐项读取
+        scan = None
+        if scan_all is not None:
+            scan = scan_all(msg_window=30, diary_k=0, stats_n=0, csv_path=CSV_PATH)
+            existing_count = scan.today_count
+        else:
+            existing_count = len(read_existing_for_date(today_str))
+        if existing_count:
+            print(f"提示：今天({today_str})已记录 {existing_count} 次。")
 
         raw = input("最近怎么样？输入 1-10 记录，V 可视化，D 看日记，N 退出：").strip()
         key = raw.lower()
@@ -368,7 +432,7 @@ def main():
             print("请输入 1-10 之间的整数。")
             continue
 
-        used_recent = read_recent_messages(30)
+        used_recent = scan.recent_messages if scan is not None else read_recent_messages(30)
         msg = choose_message(score, messages, excludes=used_recent)
         print("\n—— 今日寄语 ——")
         print(msg)
@@ -385,7 +449,11 @@ def main():
         append_record(today_str, score, msg, note)
         print("\n记录完成，已写入 CSV。")
         # 记录后回显一条迷你趋势，提升反馈感
-        show_recent_stats(7)
+        if scan_all is not None:
+            scan = scan_all(msg_window=30, diary_k=0, stats_n=7, csv_path=CSV_PATH)
+            show_recent_stats(7, series=(scan.days, scan.values))
+        else:
+            show_recent_stats(7)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file